@@ -3,12 +3,36 @@ import numpy as np
 import cv2
 from tron2_control import RobotConfig 
 
+
+def voxel_downsample(points, colors=None, voxel_size=0.005):
+    """体素网格降采样：同一体素内的点 (及颜色) 取平均"""
+    if points.shape[0] == 0:
+        return points, colors
+
+    keys = np.floor(points / voxel_size).astype(np.int64)
+    keys -= keys.min(axis=0)
+    linear = np.ravel_multi_index(keys.T, keys.max(axis=0) + 1)
+    _, inverse, counts = np.unique(linear, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+
+    def _mean(values):
+        return np.stack([np.bincount(inverse, weights=values[:, i]) for i in range(values.shape[1])], axis=1) / counts[:, None]
+
+    points = _mean(points).astype(np.float32)
+    if colors is not None:
+        colors = _mean(colors).astype(np.uint8)
+    return points, colors
+
+
 class MultiCamManager:
     def __init__(self, config):
         self.config = config
         self.pipelines = {}
         self.aligners = {}
+        self.depth_filters = {}
         self.profiles = {}
+        self.depth_scales = {}
+        self.ray_grids = {}  # cam_id -> (intrinsics key, (H, W, 3) 已乘 depth_scale 的像素射线)
         self.active_serials = []
 
         print("根据配置检查需要启动的相机...")
@@ -41,51 +65,109 @@ class MultiCamManager:
             if serial not in connected_serials:
                 raise Exception(f"错误: 配置中启用的相机 (序列号: {serial}) 未连接!")
 
+        camera_settings = {
+            self.config.head_camera_serial: ("head", self.config.head_camera_stream),
+            self.config.left_wrist_camera_serial: ("left_wrist", self.config.left_wrist_camera_stream),
+            self.config.right_wrist_camera_serial: ("right_wrist", self.config.right_wrist_camera_stream),
+        }
+        devices_by_serial = {dev.get_info(rs.camera_info.serial_number): dev for dev in devices}
+
+        # 先校验所有相机的配置，避免前面的相机已启动后才因后面的配置错误而失败
+        cameras = []
         for serial in self.active_serials:
-            pipe = rs.pipeline()
-            rsconfig = rs.config()
-            rsconfig.enable_device(serial)
-
-            cam_id = ""
-            if serial == self.config.head_camera_serial:
-                cam_id = f"head_{serial}"
-                rsconfig.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 15)
-                rsconfig.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 15)
-            elif serial == self.config.left_wrist_camera_serial:
-                cam_id = f"left_wrist_{serial}"
-                rsconfig.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 15)
-                rsconfig.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 15)
-            elif serial == self.config.right_wrist_camera_serial:
-                cam_id = f"right_wrist_{serial}"
-                rsconfig.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 15)
-                rsconfig.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 15)
-            
-            if not cam_id: continue
+            if serial not in camera_settings: continue
+            name, stream_cfg = camera_settings[serial]
+            cam_id = f"{name}_{serial}"
+            self._validate_stream_config(cam_id, devices_by_serial[serial], stream_cfg)
+            cameras.append((cam_id, serial, stream_cfg))
+
+        try:
+            for cam_id, serial, stream_cfg in cameras:
+                pipe = rs.pipeline()
+                rsconfig = rs.config()
+                rsconfig.enable_device(serial)
+                if stream_cfg.enable_depth:
+                    rsconfig.enable_stream(rs.stream.depth, stream_cfg.width, stream_cfg.height, rs.format.z16, stream_cfg.fps)
+                rsconfig.enable_stream(rs.stream.color, stream_cfg.width, stream_cfg.height, rs.format.bgr8, stream_cfg.fps)
 
-            print(f"正在启动相机: {cam_id}...")
-            profile = pipe.start(rsconfig)
-            self.pipelines[cam_id] = pipe
-            self.profiles[cam_id] = profile
-            self.aligners[cam_id] = rs.align(rs.stream.color)
+                print(f"正在启动相机: {cam_id} ({stream_cfg.width}x{stream_cfg.height}@{stream_cfg.fps}fps, 深度: {'开' if stream_cfg.enable_depth else '关'})...")
+                profile = pipe.start(rsconfig)
+                self.pipelines[cam_id] = pipe
+                self.profiles[cam_id] = profile
+                if stream_cfg.enable_depth:
+                    self.aligners[cam_id] = rs.align(rs.stream.color)
+                    self.depth_filters[cam_id] = self._build_depth_filters(stream_cfg)
+                    self.depth_scales[cam_id] = profile.get_device().first_depth_sensor().get_depth_scale()
+        except Exception:
+            # 构造函数抛出后调用方拿不到实例，这里先停掉已经启动的相机
+            self.stop()
+            raise
             
         print(f"\n共 {len(self.pipelines)} 个相机初始化成功！")
 
+    @staticmethod
+    def _validate_stream_config(cam_id, device, stream_cfg):
+        """检查相机是否支持配置的分辨率 / 帧率，不支持时列出该设备可用的组合"""
+        if not stream_cfg.enable_depth:
+            if stream_cfg.decimation != 1 or stream_cfg.spatial_filter or stream_cfg.temporal_filter:
+                raise ValueError(f"错误: 相机 {cam_id} 未启用深度流 (enable_depth=False)，不能配置 decimation / spatial_filter / temporal_filter")
+        elif not 1 <= stream_cfg.decimation <= 8:
+            raise ValueError(f"错误: 相机 {cam_id} 的 decimation 必须在 1~8 之间, 但得到 {stream_cfg.decimation}")
+
+        supported = set()
+        for sensor in device.query_sensors():
+            for sp in sensor.get_stream_profiles():
+                if sp.is_video_stream_profile():
+                    vp = sp.as_video_stream_profile()
+                    supported.add((sp.stream_type(), sp.format(), vp.width(), vp.height(), sp.fps()))
+
+        required = [(rs.stream.color, rs.format.bgr8)]
+        if stream_cfg.enable_depth:
+            required.append((rs.stream.depth, rs.format.z16))
+        for stream, fmt in required:
+            if (stream, fmt, stream_cfg.width, stream_cfg.height, stream_cfg.fps) not in supported:
+                available = sorted({(w, h, fps) for st, f, w, h, fps in supported if st == stream and f == fmt})
+                raise ValueError(
+                    f"错误: 相机 {cam_id} 不支持 {stream} {stream_cfg.width}x{stream_cfg.height}@{stream_cfg.fps}fps, "
+                    f"可用的 (宽, 高, 帧率): {available}")
+
+    @staticmethod
+    def _build_depth_filters(stream_cfg):
+        """按 RealSense 推荐顺序构建深度滤波链: 抽取 -> 视差域 -> 空间 -> 时域 -> 深度域"""
+        filters = []
+        if stream_cfg.decimation > 1:
+            decimation = rs.decimation_filter()
+            decimation.set_option(rs.option.filter_magnitude, stream_cfg.decimation)
+            filters.append(decimation)
+        if stream_cfg.spatial_filter or stream_cfg.temporal_filter:
+            filters.append(rs.disparity_transform(True))
+            if stream_cfg.spatial_filter:
+                filters.append(rs.spatial_filter())
+            if stream_cfg.temporal_filter:
+                filters.append(rs.temporal_filter())
+            filters.append(rs.disparity_transform(False))
+        return filters
+
     def get_frames(self, get_depth: bool = False):
         all_frames_data = {}
         for cam_id, pipe in self.pipelines.items():
             try:
                 frames = pipe.wait_for_frames(timeout_ms=2000)
-                aligned_frames = self.aligners[cam_id].process(frames)
-                color_frame = aligned_frames.get_color_frame()
-                
-                color_image = np.asanyarray(color_frame.get_data()) if color_frame else None
                 depth_image = None
-                
-                if get_depth:
+
+                if get_depth and cam_id in self.aligners:
+                    for depth_filter in self.depth_filters[cam_id]:
+                        frames = depth_filter.process(frames).as_frameset()
+                    aligned_frames = self.aligners[cam_id].process(frames)
+                    color_frame = aligned_frames.get_color_frame()
                     depth_frame = aligned_frames.get_depth_frame()
                     if depth_frame:
                         depth_image = np.asanyarray(depth_frame.get_data())
-                
+                else:
+                    # 对齐到彩色流不会改变彩色图像，不需要深度时跳过滤波与对齐
+                    color_frame = frames.get_color_frame()
+
+                color_image = np.asanyarray(color_frame.get_data()) if color_frame else None
                 all_frames_data[cam_id] = {'color': color_image, 'depth': depth_image}
 
             except RuntimeError:
@@ -95,6 +177,85 @@ class MultiCamManager:
             
         return all_frames_data
 
+    def _get_ray_grid(self, cam_id):
+        """
+        返回对齐后 (彩色相机) 内参下每个像素的射线 (x/z, y/z, 1) * depth_scale，
+        按 stream profile 的内参缓存，z16 深度直接乘以它即得到以米为单位的 XYZ。
+        RealSense 彩色流的畸变系数为 0，这里不做去畸变。
+        """
+        intr = self.profiles[cam_id].get_stream(rs.stream.color).as_video_stream_profile().get_intrinsics()
+        key = (intr.width, intr.height, intr.fx, intr.fy, intr.ppx, intr.ppy)
+        cached = self.ray_grids.get(cam_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        u, v = np.meshgrid(np.arange(intr.width, dtype=np.float32), np.arange(intr.height, dtype=np.float32))
+        rays = np.stack([(u - intr.ppx) / intr.fx, (v - intr.ppy) / intr.fy, np.ones_like(u)], axis=-1)
+        rays *= np.float32(self.depth_scales[cam_id])
+        self.ray_grids[cam_id] = (key, rays)
+        return rays
+
+    def depth_to_point_cloud(self, cam_id, depth_image, color_image=None, voxel_size=None, extrinsic=None):
+        """
+        将对齐后的深度图转换为点云。
+        返回 {'points': (N, 3) float32 米, 'colors': (N, 3) uint8 BGR 或 None}，无效深度 (0) 的像素被剔除。
+        extrinsic 为 4x4 相机到目标坐标系 (如机器人基座) 的齐次变换。
+        """
+        if cam_id not in self.depth_scales:
+            raise ValueError(f"相机 {cam_id} 未启用深度流 (enable_depth=False)，无法生成点云")
+        rays = self._get_ray_grid(cam_id)
+        if depth_image.shape != rays.shape[:2]:
+            raise ValueError(f"相机 {cam_id} 的深度图尺寸 {depth_image.shape} 与内参 {rays.shape[:2]} 不一致")
+
+        if color_image is not None and color_image.shape[:2] != depth_image.shape:
+            raise ValueError(f"相机 {cam_id} 的彩色图尺寸 {color_image.shape[:2]} 与深度图 {depth_image.shape} 不一致")
+
+        valid = depth_image.reshape(-1) > 0
+        points = (depth_image[..., None] * rays).reshape(-1, 3)[valid]
+        colors = color_image.reshape(-1, 3)[valid] if color_image is not None else None
+
+        if extrinsic is not None:
+            extrinsic = np.asarray(extrinsic, dtype=np.float32)
+            points = points @ extrinsic[:3, :3].T + extrinsic[:3, 3]
+        if voxel_size:
+            points, colors = voxel_downsample(points, colors, voxel_size)
+        return {'points': points, 'colors': colors}
+
+    def get_point_clouds(self, voxel_size=None, extrinsics=None, with_color=True):
+        """
+        获取每个相机的点云，返回 {cam_id: {'points', 'colors'}}。
+        extrinsics 为 {cam_id: 4x4}，给出的相机点云会被变换到公共坐标系。
+        """
+        extrinsics = extrinsics or {}
+        clouds = {}
+        for cam_id, data in self.get_frames(get_depth=True).items():
+            if data['depth'] is None or (with_color and data['color'] is None):
+                continue
+            clouds[cam_id] = self.depth_to_point_cloud(
+                cam_id, data['depth'], data['color'] if with_color else None,
+                voxel_size=voxel_size, extrinsic=extrinsics.get(cam_id))
+        return clouds
+
+    def get_fused_point_cloud(self, voxel_size=None, extrinsics=None, with_color=True):
+        """
+        将所有深度相机的点云变换到同一坐标系后合并为一个，并统一做体素降采样。
+        extrinsics 必须为每个启用深度的相机给出 4x4 变换，否则不同相机坐标系下的点无法合并。
+        """
+        extrinsics = extrinsics or {}
+        missing = [cam_id for cam_id in self.depth_scales if cam_id not in extrinsics]
+        if missing:
+            raise ValueError(f"融合点云需要每个深度相机的外参，缺少: {missing}")
+
+        clouds = list(self.get_point_clouds(extrinsics=extrinsics, with_color=with_color).values())
+        if not clouds:
+            return {'points': np.empty((0, 3), dtype=np.float32), 'colors': np.empty((0, 3), dtype=np.uint8) if with_color else None}
+
+        points = np.concatenate([c['points'] for c in clouds])
+        colors = np.concatenate([c['colors'] for c in clouds]) if with_color else None
+        if voxel_size:
+            points, colors = voxel_downsample(points, colors, voxel_size)
+        return {'points': points, 'colors': colors}
+
     def stop(self):
         if not self.pipelines: return
         print(f"\n正在停止 {len(self.pipelines)} 个相机...")
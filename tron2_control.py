@@ -4,8 +4,8 @@ import time
 import json
 import uuid
 import logging
-from dataclasses import dataclass
-from typing import Dict, Any, Iterator
+from dataclasses import dataclass, field
+from typing import Dict, Any, Iterator, Optional, Tuple, Union
 
 import numpy
 import websocket
@@ -13,6 +13,18 @@ import limxsdk.datatypes as datatypes
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - [CLIENT] - %(levelname)s - %(message)s')
 
+@dataclass
+class CameraStreamConfig:
+    # 彩色流与深度流共用同一分辨率与帧率 (深度对齐到彩色)，两者都必须被设备支持
+    width: int = 640
+    height: int = 480
+    fps: int = 15
+    enable_depth: bool = True       # False 时只开启彩色流
+    decimation: int = 1             # 深度抽取倍数，1 表示关闭 (RealSense 支持 2~8)，以下滤波仅在 enable_depth 时可用
+    spatial_filter: bool = False    # 深度空间滤波
+    temporal_filter: bool = False   # 深度时域滤波
+
+
 @dataclass
 class RobotConfig:
     ip_address: str = "10.192.1.2" 
@@ -26,6 +38,13 @@ class RobotConfig:
     left_wrist_camera: bool = True
     right_wrist_camera: bool = True
     head_camera: bool = True
+    left_wrist_camera_stream: CameraStreamConfig = field(default_factory=CameraStreamConfig)
+    right_wrist_camera_stream: CameraStreamConfig = field(default_factory=CameraStreamConfig)
+    head_camera_stream: CameraStreamConfig = field(default_factory=CameraStreamConfig)
+    workspace_min: Optional[Tuple[float, float, float]] = None  # 末端位置下界 (x, y, z)，单位 m，None 表示不限制
+    workspace_max: Optional[Tuple[float, float, float]] = None  # 末端位置上界 (x, y, z)，单位 m，None 表示不限制
+    max_cartesian_step: Optional[float] = None                   # 相邻两步末端位置的最大位移，单位 m，None 表示不限制
+    max_rotation_step: Optional[float] = None                    # 相邻两步末端姿态的最大转角，单位 rad，None 表示不限制
 
 
 class WebSocketManager:
@@ -128,6 +147,164 @@ class MoveJSequence:
         }
         return command
 
+class MovePSequence:
+    """
+    末端笛卡尔动作序列，一次性向量化完成全部 T 步的校验与转换。
+    支持两种输入:
+      - (T, 2, 4, 4): 左右臂末端齐次变换矩阵
+      - (T, 2, 7):    左右臂末端位置 + 四元数 (x, y, z, qx, qy, qz, qw)
+    每步转换为 request_movep 所需的 24 维 pos: 每个手臂依次为位置 (3) + 按行展开的旋转矩阵 (9)。
+    旋转块必须接近 SO(3)：奇异、反射 (det <= 0) 或偏离过大的旋转会被拒绝，只修正微小的数值误差。
+    """
+    ROTATION_TOLERANCE = 1e-2   # ‖R - UVᵀ‖_F 的上限，超过则视为无效旋转
+    ARM_NAMES = ("左", "右")
+    def __init__(self, config: RobotConfig, policy_inference_result: numpy.ndarray, orthonormalize: bool = True,
+                 start_pose: Optional[numpy.ndarray] = None):
+        """
+        start_pose 为机器人当前末端位姿，形状 (2, 4, 4) 或 (2, 7)。给出时步长限制同样作用于
+        当前位姿 -> 步骤 0；未给出时第一步 (通常是最大的一步) 不受 max_cartesian_step / max_rotation_step 约束。
+        """
+        self.config = config
+        self.current_step = 0
+
+        poses = numpy.asarray(policy_inference_result, dtype=float)
+        if poses.ndim not in (3, 4) or poses.shape[1] != 2:
+            raise ValueError(f"期望 policy_inference_result 的形状为 (T, 2, 4, 4) 或 (T, 2, 7), 但得到 {poses.shape}")
+        if poses.shape[0] != config.control_horizon:
+            raise ValueError(f"期望动作步数为 {config.control_horizon}, 但得到 {poses.shape[0]}")
+        position, rotation = self._parse_poses(poses, orthonormalize)
+        self._check_workspace(position)
+
+        if start_pose is not None:
+            start = numpy.asarray(start_pose, dtype=float)
+            if start.shape not in ((2, 4, 4), (2, 7)):
+                raise ValueError(f"期望 start_pose 的形状为 (2, 4, 4) 或 (2, 7), 但得到 {start.shape}")
+            start_position, start_rotation = self._parse_poses(start[None], orthonormalize=True, label="当前位姿 (start_pose)")
+            self._check_step_size(numpy.concatenate([start_position, position]),
+                                  numpy.concatenate([start_rotation, rotation]), first_step=-1)
+        else:
+            self._check_step_size(position, rotation, first_step=0)
+
+        # (T, 2, 12) -> (T, 24)，get_single_cmd 只需取行
+        self.position = position
+        self.rotation = rotation
+        self.pos = numpy.concatenate([position, rotation.reshape(*rotation.shape[:2], 9)], axis=-1).reshape(poses.shape[0], 24)
+
+    def _parse_poses(self, poses: numpy.ndarray, orthonormalize: bool, label: Optional[str] = None):
+        """
+        (N, 2, 4, 4) 或 (N, 2, 7) -> 位置 (N, 2, 3) 与校验后的旋转 (N, 2, 3, 3)。
+        label 用于错误信息中代替 "步骤 i" (如当前位姿)，未给出时按轨迹步骤报告。
+        """
+        if poses.shape[2:] == (4, 4):
+            bad_row = numpy.any(numpy.abs(poses[..., 3, :] - [0.0, 0.0, 0.0, 1.0]) > 1e-6, axis=-1)
+            if numpy.any(bad_row):
+                step, arm = numpy.argwhere(bad_row)[0]
+                raise ValueError(f"{label or f'步骤 {step}'} 的{self.ARM_NAMES[arm]}臂齐次变换矩阵最后一行应为 [0, 0, 0, 1], 但得到 {poses[step, arm, 3].tolist()}")
+            position = poses[..., :3, 3]
+            rotation = poses[..., :3, :3]
+        elif poses.shape[2:] == (7,):
+            position = poses[..., :3]
+            rotation = self._quat_to_rotation(poses[..., 3:])
+        else:
+            raise ValueError(f"期望 {label or 'policy_inference_result'} 的形状为 (T, 2, 4, 4) 或 (T, 2, 7), 但得到 {poses.shape}")
+
+        if not numpy.all(numpy.isfinite(position)) or not numpy.all(numpy.isfinite(rotation)):
+            raise ValueError(f"{label or '末端位姿'}中包含 NaN 或 Inf")
+        return position, self._validate_rotation(rotation, snap=orthonormalize, label=label)
+
+    @staticmethod
+    def _quat_to_rotation(quat: numpy.ndarray) -> numpy.ndarray:
+        """(..., 4) 四元数 (qx, qy, qz, qw) -> (..., 3, 3) 旋转矩阵"""
+        norm = numpy.linalg.norm(quat, axis=-1, keepdims=True)
+        if numpy.any(norm < 1e-8):
+            raise ValueError("四元数模长接近 0，无法转换为旋转矩阵")
+        x, y, z, w = numpy.moveaxis(quat / norm, -1, 0)
+        return numpy.stack([
+            1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+            2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+            2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y),
+        ], axis=-1).reshape(*quat.shape[:-1], 3, 3)
+
+    def _validate_rotation(self, rotation: numpy.ndarray, snap: bool = True, label: Optional[str] = None) -> numpy.ndarray:
+        """
+        通过批量 SVD 校验 (T, 2, 3, 3) 旋转块：奇异、det <= 0 或与最近正交矩阵 UVᵀ 距离超过
+        ROTATION_TOLERANCE 时抛出 ValueError；snap 为 True 时返回投影后的 UVᵀ 以消除数值漂移。
+        """
+        u, sv, vt = numpy.linalg.svd(rotation)
+        nearest = u @ vt
+        error = numpy.linalg.norm(rotation - nearest, axis=(-2, -1))
+        invalid = (sv[..., -1] < 1 - self.ROTATION_TOLERANCE) | (numpy.linalg.det(rotation) <= 0) | (error > self.ROTATION_TOLERANCE)
+        if numpy.any(invalid):
+            step, arm = numpy.argwhere(invalid)[0]
+            raise ValueError(
+                f"{label or f'步骤 {step}'} 的{self.ARM_NAMES[arm]}臂旋转矩阵不是有效旋转 "
+                f"(最小奇异值 {sv[step, arm, -1]:.4f}, det {numpy.linalg.det(rotation[step, arm]):.4f}, "
+                f"偏离 {error[step, arm]:.4f}, 容差 {self.ROTATION_TOLERANCE}): {rotation[step, arm].tolist()}")
+        return nearest if snap else rotation
+
+    def _check_workspace(self, position: numpy.ndarray):
+        lower = self.config.workspace_min
+        upper = self.config.workspace_max
+        outside = numpy.zeros(position.shape[:2], dtype=bool)
+        if lower is not None:
+            outside |= numpy.any(position < numpy.asarray(lower), axis=-1)
+        if upper is not None:
+            outside |= numpy.any(position > numpy.asarray(upper), axis=-1)
+        if numpy.any(outside):
+            step, arm = numpy.argwhere(outside)[0]
+            raise ValueError(f"步骤 {step} 的{self.ARM_NAMES[arm]}臂末端位置 {position[step, arm].tolist()} 超出工作空间 [{lower}, {upper}]")
+
+    def _check_step_size(self, position: numpy.ndarray, rotation: numpy.ndarray, first_step: int = 0):
+        """检查相邻位姿的平移与旋转步长，first_step 为 position[0] 对应的步骤号 (-1 表示当前位姿)"""
+        if position.shape[0] < 2:
+            return
+
+        def _label(i):
+            return "当前位姿" if i < 0 else f"步骤 {i}"
+
+        if self.config.max_cartesian_step is not None:
+            step_size = numpy.linalg.norm(numpy.diff(position, axis=0), axis=-1)   # (N-1, 2)
+            if numpy.any(step_size > self.config.max_cartesian_step):
+                i, arm = numpy.argwhere(step_size > self.config.max_cartesian_step)[0]
+                raise ValueError(f"{_label(i + first_step)} -> {_label(i + first_step + 1)} 的{self.ARM_NAMES[arm]}臂末端位移 {step_size[i, arm]:.4f} m 超过上限 {self.config.max_cartesian_step} m")
+
+        if self.config.max_rotation_step is not None:
+            # 相对旋转 R_tᵀ R_{t+1} 的转角: cos θ = (tr - 1) / 2
+            trace = numpy.sum(rotation[:-1] * rotation[1:], axis=(-2, -1))
+            angle = numpy.arccos(numpy.clip((trace - 1) / 2, -1.0, 1.0))   # (N-1, 2)
+            if numpy.any(angle > self.config.max_rotation_step):
+                i, arm = numpy.argwhere(angle > self.config.max_rotation_step)[0]
+                raise ValueError(f"{_label(i + first_step)} -> {_label(i + first_step + 1)} 的{self.ARM_NAMES[arm]}臂末端转角 {angle[i, arm]:.4f} rad 超过上限 {self.config.max_rotation_step} rad")
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        self.current_step = 0
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        if self.current_step >= self.pos.shape[0]:
+            raise StopIteration
+
+        cmd = self.get_single_cmd(self.current_step)
+        self.current_step += 1
+        return cmd
+
+    def get_single_cmd(self, step: int = 0) -> Dict[str, Any]:
+        """为单个步骤生成 movep JSON 指令"""
+        if step >= self.pos.shape[0]:
+            raise IndexError(f"步骤 {step} 超出动作范围 {self.pos.shape[0]}")
+
+        command = {
+            "accid": self.config.accid,
+            "title": "request_movep",
+            "timestamp": int(time.time() * 1000),
+            "guid": str(uuid.uuid4()),
+            "data": {
+                "time": 3,  # 与 MoveJSequence 保持一致，直接使用控制频率太快会很危险
+                "pos": self.pos[step].tolist() # 左右臂各 3 维位置 + 9 维旋转矩阵
+            }
+        }
+        return command
+
 class Tron2:
     def __init__(self, config: RobotConfig):
         self.config = config
@@ -141,7 +318,7 @@ class Tron2:
     def get_state(self) -> Dict[str, Any]:
         return self.ws_manager.get_latest_state()
     
-    def control(self, movej_sequence: MoveJSequence):
+    def control(self, movej_sequence: Union[MoveJSequence, MovePSequence]):
         try:
             for cmd in movej_sequence:
                 self.ws_manager.send_command(cmd)
@@ -149,7 +326,7 @@ class Tron2:
         except Exception as e:
             logging.error(f"发送控制序列失败: {e}")
     
-    def control_single_step(self, movej_sequence: MoveJSequence, step: int = 0):
+    def control_single_step(self, movej_sequence: Union[MoveJSequence, MovePSequence], step: int = 0):
         try:
             cmd = movej_sequence.get_single_cmd(step)
             self.ws_manager.send_command(cmd)
@@ -0,0 +1,409 @@
+import sys
+import time
+import json
+import uuid
+import queue
+import logging
+import selectors
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Any, Iterable, List, Optional
+
+import numpy
+import websocket
+import limxsdk.datatypes as datatypes
+
+from tron2_control import RobotConfig, MoveJSequence
+
+
+class RobotLink:
+    """单台机器人的连接、状态与健康指标，由 FleetController 的共享 I/O 线程驱动"""
+
+    MAX_PENDING = 1000      # 等待响应的指令数上限，超出后丢弃最旧的
+    METRIC_WINDOW = 200     # 延迟 / 抖动统计的滑动窗口长度
+
+    def __init__(self, config: RobotConfig):
+        self.config = config
+        self.ws_url = f"ws://{config.ip_address}:5000"
+        self.ws: Optional[websocket.WebSocket] = None
+        self.is_connected = False
+        self.latest_state: Dict[str, Any] = {}
+        self.send_lock = threading.Lock()
+
+        self.connecting = False
+        self.send_failed = False    # 发送失败后 WebSocket 帧可能已不完整，由 I/O 线程断开重连
+        self.next_connect_time = 0.0
+        self.reconnect_delay = 0.5
+
+        self.has_connected = False
+        self.connected_since: Optional[float] = None
+        self.last_state_time: Optional[float] = None
+        self.last_message_time: Optional[float] = None
+        self.messages_received = 0
+        self.commands_sent = 0
+        self.send_errors = 0
+        self.reconnects = 0
+        self.dispatch_overruns = 0
+        self.pending: "OrderedDict[str, float]" = OrderedDict()   # guid -> 发送时刻
+        self.latencies = deque(maxlen=self.METRIC_WINDOW)           # 指令往返延迟 (s)
+        self.dispatch_jitter = deque(maxlen=self.METRIC_WINDOW)     # 实际下发时刻 - 公共时钟节拍 (s)
+
+    def health(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        latencies = numpy.asarray(self.latencies, dtype=float)
+        jitter = numpy.asarray(self.dispatch_jitter, dtype=float)
+        return {
+            "accid": self.config.accid,
+            "ip_address": self.config.ip_address,
+            "connected": self.is_connected,
+            "uptime_s": now - self.connected_since if self.connected_since is not None else None,
+            "state_age_s": now - self.last_state_time if self.last_state_time is not None else None,
+            "messages_received": self.messages_received,
+            "commands_sent": self.commands_sent,
+            "send_errors": self.send_errors,
+            "reconnects": self.reconnects,
+            "pending_responses": len(self.pending),
+            "latency_ms_mean": float(latencies.mean() * 1000) if latencies.size else None,
+            "latency_ms_p95": float(numpy.percentile(latencies, 95) * 1000) if latencies.size else None,
+            "dispatch_jitter_ms_mean": float(jitter.mean() * 1000) if jitter.size else None,
+            "dispatch_jitter_ms_max": float(jitter.max() * 1000) if jitter.size else None,
+            "dispatch_overruns": self.dispatch_overruns,
+        }
+
+
+class FleetController:
+    """
+    在同一进程内管理多台 Tron2：
+    所有 WebSocket 连接由一个共享的 I/O 线程通过 selectors 复用收发，
+    阻塞的建连与握手放在独立的连接线程中，不可达的机器人不会拖慢其它机器人的接收，
+    动作序列按公共时钟同步下发，状态与健康指标统一汇总。
+    机器人通过 accid 或 ip_address 标识。
+    """
+
+    RECV_TIMEOUT = 0.05     # 单次 recv / send 的超时，防止某台机器人发送半帧时卡住 I/O 线程
+
+    def __init__(self, configs: List[RobotConfig], control_rate: Optional[int] = None,
+                 connect_timeout: float = 0.5, max_reconnect_delay: float = 5.0):
+        if not configs:
+            raise ValueError("至少需要提供一个 RobotConfig")
+
+        self.links: Dict[str, RobotLink] = {}
+        for config in configs:
+            if config.accid in self.links:
+                raise ValueError(f"重复的机器人序列号: {config.accid}")
+            self.links[config.accid] = RobotLink(config)
+
+        self.control_rate = control_rate or configs[0].control_rate
+        self.connect_timeout = connect_timeout
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self._selector = selectors.DefaultSelector()
+        self._state_cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._connect_requests: "queue.Queue[RobotLink]" = queue.Queue()
+        self._connected = queue.Queue()   # (link, ws)，由连接线程交给 I/O 线程注册
+        self.connector_thread = threading.Thread(target=self._connector_loop, daemon=True)
+        self.connector_thread.start()
+        self.thread = threading.Thread(target=self._io_loop, daemon=True)
+        self.thread.start()
+
+    # ---------- 共享 I/O 线程 ----------
+
+    def _io_loop(self):
+        """单线程轮询所有机器人：调度重连、注册新建立的连接，并读取所有就绪的连接"""
+        logging.info(f"机群 I/O 线程启动，共 {len(self.links)} 台机器人")
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            for link in self.links.values():
+                if link.send_failed:
+                    link.send_failed = False
+                    self._disconnect(link)
+                if link.ws is None and not link.connecting and now >= link.next_connect_time:
+                    link.connecting = True
+                    self._connect_requests.put(link)
+
+            while not self._connected.empty():
+                self._activate(*self._connected.get_nowait())
+
+            if not self._selector.get_map():
+                # Windows 下 select 不接受空的文件描述符集合
+                self._stop_event.wait(0.05)
+                continue
+
+            for key, _ in self._selector.select(timeout=0.05):
+                self._receive(key.data)
+
+        self.connector_thread.join(timeout=self.connect_timeout + 1.0)
+        while not self._connected.empty():
+            _, ws = self._connected.get_nowait()
+            ws.close()
+        for link in self.links.values():
+            self._disconnect(link, reconnect=False)
+        self._selector.close()
+        logging.info("机群 I/O 线程已退出")
+
+    def _connector_loop(self):
+        """在独立线程中完成阻塞的 TCP 连接与 WebSocket 握手，成功后交给 I/O 线程"""
+        while not self._stop_event.is_set():
+            try:
+                link = self._connect_requests.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            try:
+                ws = websocket.create_connection(link.ws_url, timeout=self.connect_timeout)
+            except Exception as e:
+                logging.debug(f"[{link.config.accid}] 连接失败: {e}")
+                link.next_connect_time = time.monotonic() + link.reconnect_delay
+                link.reconnect_delay = min(link.reconnect_delay * 2, self.max_reconnect_delay)
+                link.connecting = False
+                continue
+
+            # 仅在 select 报告可读后才 recv，超时只用于防止半帧时卡住 I/O 线程；
+            # 该超时同样作用于 send，发送超时会使连接被重建 (见 send_command)
+            ws.settimeout(self.RECV_TIMEOUT)
+            self._connected.put((link, ws))
+
+    def _activate(self, link: RobotLink, ws: websocket.WebSocket):
+        """在 I/O 线程中登记连接线程建立好的连接"""
+        with link.send_lock:
+            link.ws = ws
+            link.is_connected = True
+        link.connecting = False
+        if link.has_connected:
+            link.reconnects += 1
+        link.has_connected = True
+        link.connected_since = time.monotonic()
+        link.reconnect_delay = 0.5
+        self._selector.register(ws.sock, selectors.EVENT_READ, link)
+        logging.info(f"[{link.config.accid}] 成功连接到机器人 WebSocket 服务器 at {link.ws_url}")
+
+        with self._state_cond:
+            self._state_cond.notify_all()
+
+    def _disconnect(self, link: RobotLink, reconnect: bool = True):
+        with link.send_lock:
+            ws, link.ws = link.ws, None
+            link.is_connected = False
+            link.connected_since = None
+            link.pending.clear()
+        if ws is None:
+            return
+        try:
+            self._selector.unregister(ws.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            ws.close(timeout=0.1)
+        except Exception:
+            pass
+        if reconnect:
+            link.next_connect_time = time.monotonic() + link.reconnect_delay
+            logging.warning(f"[{link.config.accid}] 连接已断开，{link.reconnect_delay:.1f}s 后重连")
+
+    def _receive(self, link: RobotLink):
+        try:
+            opcode, frame = link.ws.recv_data_frame(control_frame=True)
+        except websocket.WebSocketTimeoutException:
+            return
+        except Exception as e:
+            logging.error(f"[{link.config.accid}] WebSocket 错误: {e}")
+            self._disconnect(link)
+            return
+
+        if opcode == websocket.ABNF.OPCODE_CLOSE:
+            self._disconnect(link)
+            return
+        if opcode not in (websocket.ABNF.OPCODE_TEXT, websocket.ABNF.OPCODE_BINARY):
+            return  # ping / pong 由 websocket-client 自动处理
+
+        now = time.monotonic()
+        link.messages_received += 1
+        link.last_message_time = now
+        message = frame.data.decode("utf-8") if isinstance(frame.data, bytes) else frame.data
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            logging.error(f"[{link.config.accid}] 解析JSON失败: {message}")
+            return
+
+        title = data.get("title", "")
+        if title == "notify_robot_info": # 机器人基本信息每秒上报一次
+            with self._state_cond:
+                link.latest_state = data.get("data", {})
+                link.last_state_time = now
+                self._state_cond.notify_all()
+            return
+
+        with link.send_lock:
+            sent_at = link.pending.pop(data.get("guid", ""), None)
+        if sent_at is not None:
+            link.latencies.append(now - sent_at)
+        logging.info(f"[{link.config.accid}] 收到消息: {message}")
+
+    # ---------- 连接与状态 ----------
+
+    def _resolve(self, robot: str) -> RobotLink:
+        """通过 accid 或 ip_address 查找机器人"""
+        if robot in self.links:
+            return self.links[robot]
+        for link in self.links.values():
+            if link.config.ip_address == robot:
+                return link
+        raise KeyError(f"未知的机器人: {robot}")
+
+    def wait_until_connected(self, timeout: Optional[float] = None) -> bool:
+        """阻塞直到所有机器人均已连接，超时返回 False"""
+        with self._state_cond:
+            return self._state_cond.wait_for(
+                lambda: all(link.is_connected for link in self.links.values()), timeout)
+
+    def get_state(self, robot: str) -> Dict[str, Any]:
+        return self._resolve(robot).latest_state
+
+    def get_states(self) -> Dict[str, Dict[str, Any]]:
+        """所有机器人最新状态的快照，key 为 accid"""
+        with self._state_cond:
+            return {accid: link.latest_state for accid, link in self.links.items()}
+
+    def get_health(self) -> Dict[str, Dict[str, Any]]:
+        """所有机器人的连接健康与延迟指标，key 为 accid"""
+        return {accid: link.health() for accid, link in self.links.items()}
+
+    # ---------- 指令下发 ----------
+
+    def send_command(self, robot: str, command: Dict[str, Any]) -> bool:
+        """向指定机器人发送 JSON 指令，成功返回 True"""
+        link = self._resolve(robot)
+        with link.send_lock:
+            if not link.is_connected or link.ws is None:
+                logging.error(f"[{link.config.accid}] 无法发送指令：机器人未连接。")
+                link.send_errors += 1
+                return False
+            try:
+                link.ws.send(json.dumps(command))
+            except Exception as e:
+                # 发送可能中断在帧中间，之后的写入会破坏数据流：停止使用该连接并交给 I/O 线程重连
+                logging.error(f"[{link.config.accid}] 发送指令失败，连接将被重建: {e}")
+                link.send_errors += 1
+                link.is_connected = False
+                link.send_failed = True
+                return False
+
+            link.commands_sent += 1
+            guid = command.get("guid")
+            if guid:
+                link.pending[guid] = time.monotonic()
+                while len(link.pending) > link.MAX_PENDING:
+                    link.pending.popitem(last=False)
+        return True
+
+    def control(self, sequences: Dict[str, Iterable[Dict[str, Any]]], start_delay: float = 0.0) -> Dict[str, str]:
+        """
+        按公共时钟同步执行多台机器人的动作序列。
+        sequences 的 key 为 accid 或 ip_address，value 为 MoveJSequence 等指令迭代器。
+        第 k 个节拍的绝对时刻为 t0 + k / control_rate，同一节拍内所有机器人的指令
+        连续下发并带有相同的时间戳；节拍基于绝对时刻计算，不会随循环开销累积漂移。
+        任一机器人在开始前未连接时抛出 RuntimeError；执行中任一机器人生成或发送指令失败时，
+        立即停止所有机器人的序列 (同一节拍内已发出的指令无法撤回)。
+        返回失败信息 {accid: 原因}，为空表示所有序列均已完整下发。
+        """
+        streams = {self._resolve(robot): iter(seq) for robot, seq in sequences.items()}
+        disconnected = [link.config.accid for link in streams if not link.is_connected]
+        if disconnected:
+            raise RuntimeError(f"以下机器人未连接，拒绝开始同步控制: {disconnected}")
+
+        period = 1.0 / self.control_rate
+        t0 = time.perf_counter() + start_delay
+        step = 0
+        failures: Dict[str, str] = {}
+
+        while streams and not failures:
+            deadline = t0 + step * period
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+
+            timestamp = int(time.time() * 1000)
+            for link, stream in list(streams.items()):
+                try:
+                    cmd = next(stream)
+                except StopIteration:
+                    del streams[link]
+                    continue
+                except Exception as e:
+                    failures[link.config.accid] = f"步骤 {step} 生成控制指令失败: {e}"
+                    break
+
+                cmd["timestamp"] = timestamp
+                jitter = time.perf_counter() - deadline
+                link.dispatch_jitter.append(jitter)
+                if jitter > period:
+                    link.dispatch_overruns += 1
+                if not self.send_command(link.config.accid, cmd):
+                    failures[link.config.accid] = f"步骤 {step} 发送控制指令失败"
+                    break
+            step += 1
+
+        if failures:
+            logging.error(f"同步控制在步骤 {step - 1} 中止，所有机器人停止下发: {failures}")
+        return failures
+
+    def set_robot_light(self, light_effect: datatypes.LightEffect, robots: Optional[List[str]] = None):
+        """设置灯效，robots 为空时作用于全部机器人"""
+        effect_id = light_effect.value + 1
+        for robot in (robots if robots is not None else list(self.links)):
+            link = self._resolve(robot)
+            command = {
+                "accid": link.config.accid,
+                "title": "request_light_effect",
+                "timestamp": int(time.time() * 1000),
+                "guid": str(uuid.uuid4()),
+                "data": {
+                    "effect": effect_id
+                }
+            }
+            self.send_command(link.config.accid, command)
+
+    def stop(self):
+        """关闭所有连接并结束 I/O 线程"""
+        self._stop_event.set()
+        self.thread.join(timeout=self.connect_timeout + 2.0)
+
+
+# 流程就是为每台机器人准备一个 RobotConfig，实例化 FleetController，然后为每台机器人生成 MoveJSequence，交给 control 方法同步执行
+if __name__ == '__main__':
+    robot_configs = [
+        RobotConfig(ip_address="10.192.1.2", accid="DACH_TRON2A_003"),  # TODO: 替换为您机器人的真实 IP 与序列号
+        RobotConfig(ip_address="10.192.1.3", accid="DACH_TRON2A_004"),
+    ]
+    fleet = FleetController(robot_configs)
+    if not fleet.wait_until_connected(timeout=10.0):
+        logging.error(f"部分机器人未能在超时内连接，退出: {fleet.get_health()}")
+        fleet.stop()
+        sys.exit(1)
+
+    logging.info("设置灯效为静态绿光...")
+    fleet.set_robot_light(datatypes.LightEffect.STATIC_GREEN)
+    time.sleep(2)
+
+    logging.info("准备同步执行动作序列...")
+    sequences = {}
+    for config in robot_configs:
+        dummy_policy_output = numpy.random.uniform(low=-0.2, high=0.2, size=(config.control_horizon, config.action_dim))
+        sequences[config.accid] = MoveJSequence(config, dummy_policy_output)
+    failures = fleet.control(sequences)
+    if failures:
+        logging.error(f"控制序列未完整执行: {failures}")
+    else:
+        logging.info("控制序列执行完毕。")
+
+    time.sleep(2)
+    for accid, state in fleet.get_states().items():
+        logging.info(f"[{accid}] 状态: {state}")
+    for accid, health in fleet.get_health().items():
+        logging.info(f"[{accid}] 健康指标: {health}")
+
+    fleet.set_robot_light(datatypes.LightEffect.LOW_FLASH_RED)
+    fleet.stop()
+    logging.info("示例程序结束。")